@@ -1,25 +1,78 @@
 from fastapi import FastAPI, UploadFile, File, HTTPException, Form
-from fastapi.responses import JSONResponse
+from fastapi.responses import ORJSONResponse, Response, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
+from starlette.background import BackgroundTask
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import asynccontextmanager
+import asyncio
+import hashlib
+import io
 import tempfile
 import os
-import json
+import re
+import orjson
 import logging
-from typing import Dict, List
+from typing import Dict, Iterator, List, Tuple, Union
+
+# Thread counts must be configured before torch is imported. When running several
+# workers, the entrypoint sets TORCH_NUM_THREADS per worker to avoid oversubscription.
+TORCH_NUM_THREADS = int(os.environ.get("TORCH_NUM_THREADS", os.cpu_count() or 1))
+os.environ.setdefault("OMP_NUM_THREADS", str(TORCH_NUM_THREADS))
+os.environ.setdefault("MKL_NUM_THREADS", str(TORCH_NUM_THREADS))
+
 import torch
+
+
+def _configure_torch_threads():
+    """Apply the thread settings once per process.
+
+    The module can be imported twice in one process (as ``__main__``/``__mp_main__``
+    and again as ``app``), and torch raises if the inter-op pool is resized after
+    it has been set or used.
+    """
+    torch.set_num_threads(TORCH_NUM_THREADS)
+    if torch.get_num_interop_threads() != 1:
+        try:
+            torch.set_num_interop_threads(1)
+        except RuntimeError:
+            pass
+
+
+_configure_torch_threads()
+
 from transformers import AutoModelForCausalLM, AutoTokenizer
+from PIL import Image
+from docling.document_converter import DocumentConverter
 
-from src.extractors.page_extractor import PageContentExtractor
+from src.extractors.page_extractor import VISION_IMAGE_SIZE, PageContentExtractor
 from src.processors.transcriptions import process_transcripts
 from src.processors.build_data import build_transcripts
 from src.processors.chunk_matcher import TranscriptSlideChunker
-from src.core.embedding import model
+from src.core.embedding import EMBEDDING_BACKEND, EMBEDDING_VARIANT, model
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Uploads are copied to disk in chunks of this size to keep memory flat
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+# PDFs up to this size are processed from memory; larger ones are spilled to a temporary file
+IN_MEMORY_PDF_LIMIT = 50 * 1024 * 1024
+
+# Number of images per vision model call
+VISION_BATCH_SIZE = int(os.environ.get("VISION_BATCH_SIZE", 4))
+
+# Embed transcript windows by pooling sentence embeddings instead of encoding the window text
+POOL_WINDOW_EMBEDDINGS = os.environ.get("POOL_WINDOW_EMBEDDINGS", "false").lower() == "true"
+
+# Runs the extraction and matching pipeline one request at a time. The vision model,
+# Docling converter and PyMuPDF are shared and not thread-safe; queued requests wait
+# here without holding a thread of the default executor, which uploads and response
+# serialization keep using
+_PIPELINE_EXECUTOR = ThreadPoolExecutor(max_workers=1, thread_name_prefix="pipeline")
+
 # Global variables for vision model
 vision_model = None
 vision_tokenizer = None
@@ -34,13 +87,13 @@ async def lifespan(app: FastAPI):
     vision_device = "cuda" if torch.cuda.is_available() else "cpu"
     logger.info(f"Using device for vision model: {vision_device}")
     
+    logger.info(f"Embedding model variant: {EMBEDDING_VARIANT}")
+    
     model_id = "vikhyatk/moondream2"
     logger.info("Loading Moondream2 vision model...")
     try:
-        vision_model = AutoModelForCausalLM.from_pretrained(
-            model_id,
-            trust_remote_code=True,
-        ).to(vision_device)
+        vision_model = _load_vision_model(model_id)
+        vision_model.eval()
         
         vision_tokenizer = AutoTokenizer.from_pretrained(model_id)
         logger.info("Vision model loaded successfully!")
@@ -48,26 +101,244 @@ async def lifespan(app: FastAPI):
         logger.error(f"Failed to load vision model: {e}")
         logger.warning("Vision model endpoints will not be available")
     
+    # Matching is re-entrant, so a single chunker is shared by all requests
+    app.state.chunker = TranscriptSlideChunker(model, pool_window_embeddings=POOL_WINDOW_EMBEDDINGS)
+    
+    # Building a DocumentConverter initializes Docling's pipeline, so do it once
+    logger.info("Initializing Docling document converter...")
+    app.state.converter = DocumentConverter()
+    
+    # Opt-in: compiling moves the compile cost to startup and the first request. It runs on
+    # the pipeline thread, since CUDA graphs recorded during warmup are per thread
+    if os.environ.get("COMPILE_MODELS", "false").lower() == "true":
+        await asyncio.get_running_loop().run_in_executor(_PIPELINE_EXECUTOR, _compile_models)
+    
     yield
     
     logger.info("Shutting down...")
+    _PIPELINE_EXECUTOR.shutdown(wait=False, cancel_futures=True)
+
+def _load_vision_model(model_id: str):
+    """
+    Load the vision model with the cheapest precision the device supports.
+    
+    On CUDA the weights are loaded in bf16/fp16, or in 8-bit via bitsandbytes when VISION_LOAD_IN_8BIT=true
+    (less VRAM, but usually slower). On CPU the model stays in fp32.
+    """
+    if vision_device == "cuda":
+        torch.backends.cuda.matmul.allow_tf32 = True
+        
+        if os.environ.get("VISION_LOAD_IN_8BIT", "false").lower() == "true":
+            try:
+                import bitsandbytes  # noqa: F401
+                from transformers import BitsAndBytesConfig
+                
+                logger.info("Loading vision model in 8-bit")
+                return _from_pretrained_with_attention(
+                    model_id,
+                    quantization_config=BitsAndBytesConfig(load_in_8bit=True),
+                    device_map="auto",
+                )
+            except Exception as e:
+                logger.warning(f"8-bit loading unavailable ({e}), falling back to half precision")
+        
+        # Half precision on GPU (bf16 where supported)
+        vision_dtype = torch.bfloat16 if torch.cuda.is_bf16_supported() else torch.float16
+    else:
+        vision_dtype = torch.float32
+    logger.info(f"Vision model dtype: {vision_dtype}")
+    
+    return _from_pretrained_with_attention(model_id, torch_dtype=vision_dtype).to(vision_device)
+
+def _from_pretrained_with_attention(model_id: str, **kwargs):
+    """
+    Load the vision model with the fused attention kernel from VISION_ATTN_IMPLEMENTATION (default: sdpa).
+    
+    Falls back to the model's default attention if its remote code rejects the setting.
+    """
+    attn_implementation = os.environ.get("VISION_ATTN_IMPLEMENTATION", "sdpa")
+    try:
+        vision_model = AutoModelForCausalLM.from_pretrained(
+            model_id,
+            trust_remote_code=True,
+            attn_implementation=attn_implementation,
+            **kwargs,
+        )
+        logger.info(f"Vision model attention implementation: {attn_implementation}")
+        return vision_model
+    except (ValueError, TypeError, ImportError) as e:
+        logger.warning(f"Attention implementation '{attn_implementation}' not supported ({e}), using default attention")
+        return AutoModelForCausalLM.from_pretrained(model_id, trust_remote_code=True, **kwargs)
+
+def _compile_models():
+    """Compile the embedding transformer and the vision model submodules with torch.compile."""
+    global vision_model
+    
+    if EMBEDDING_BACKEND == "torch":
+        logger.info("Compiling embedding model with torch.compile...")
+        transformer = model._first_module()
+        transformer.auto_model = torch.compile(transformer.auto_model)
+    
+    if vision_model is not None:
+        # Moondream2 is driven through encode_image/answer_question rather than forward(),
+        # so compile its submodules in place instead of wrapping the top-level model
+        logger.info("Compiling vision model submodules with torch.compile...")
+        for name, child in list(vision_model.named_children()):
+            setattr(vision_model, name, torch.compile(child, mode="reduce-overhead", fullgraph=False))
+        
+        # Trigger compilation now so the first real request doesn't pay for it
+        logger.info("Warming up compiled vision model...")
+        try:
+            with torch.inference_mode():
+                # Same size as the slide images _render_image_fitz produces, so the recorded shapes are reused
+                enc_image = vision_model.encode_image(Image.new("RGB", (VISION_IMAGE_SIZE, VISION_IMAGE_SIZE), "white"))
+                vision_model.answer_question(enc_image, "Describe this image.", vision_tokenizer)
+            logger.info("Vision model warmup complete")
+        except Exception as e:
+            logger.warning(f"Vision model warmup failed: {e}")
 
 app = FastAPI(
     title="PDF Lecture Parser API",
     description="API for processing lecture PDFs and matching them with transcripts",
     version="1.0.0",
-    lifespan=lifespan
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse
 )
 
-# Add CORS middleware
+# Add CORS middleware. With a wildcard origin and credentials, Starlette echoes back
+# whatever Origin the request sends, letting any site make credentialed calls. Unlike
+# before, credentials are therefore only allowed for an explicit list of origins.
+cors_origins = [origin.strip() for origin in os.environ.get("CORS_ALLOW_ORIGINS", "*").split(",") if origin.strip()]
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=True,
-    allow_methods=["*"],
+    allow_origins=cors_origins,
+    allow_credentials="*" not in cors_origins,
+    allow_methods=["GET", "POST"],
     allow_headers=["*"],
 )
 
+# Compress responses over 1 KB; slide markdown and transcripts compress well
+app.add_middleware(GZipMiddleware, minimum_size=1024)
+
+
+async def _stream_upload_to_file(upload: UploadFile, target, hasher=None) -> None:
+    """Copy an uploaded file to an open binary file object in fixed-size chunks, optionally feeding a hashlib hasher."""
+    while chunk := await upload.read(UPLOAD_CHUNK_SIZE):
+        # Write in a worker thread so slow disks don't stall the event loop
+        await asyncio.to_thread(target.write, chunk)
+        if hasher is not None:
+            hasher.update(chunk)
+
+
+async def _read_pdf_upload(upload: UploadFile, hasher) -> Union[bytes, str]:
+    """
+    Read an uploaded PDF, feeding every chunk to hasher.
+    
+    Returns the raw bytes for PDFs up to IN_MEMORY_PDF_LIMIT. Larger PDFs are spilled to a
+    temporary file and its path is returned; the caller is responsible for deleting it.
+    """
+    buffer = io.BytesIO()
+    while chunk := await upload.read(UPLOAD_CHUNK_SIZE):
+        buffer.write(chunk)
+        hasher.update(chunk)
+        
+        if buffer.tell() > IN_MEMORY_PDF_LIMIT:
+            with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as temp_pdf:
+                try:
+                    await asyncio.to_thread(temp_pdf.write, buffer.getbuffer())
+                    buffer = None
+                    await _stream_upload_to_file(upload, temp_pdf, hasher)
+                except Exception:
+                    _cleanup_temp_files([temp_pdf.name])
+                    raise
+                return temp_pdf.name
+    
+    return buffer.getvalue()
+
+
+def _cleanup_temp_files(paths: List[str]) -> None:
+    """Delete temporary upload files, logging instead of raising on failure."""
+    for path in paths:
+        if path and os.path.exists(path):
+            try:
+                os.unlink(path)
+                logger.info(f"Cleaned up temporary file {path}")
+            except Exception as e:
+                logger.warning(f"Could not delete temporary file {path}: {e}")
+
+
+def _iter_ndjson_response(
+    message: str,
+    slide_data: Dict,
+    unmatched_transcripts: List[str],
+    parameters: Dict,
+    has_transcripts: bool
+) -> Iterator[bytes]:
+    """
+    Yield the process-lecture result as NDJSON records so the full payload is never serialized at once.
+    
+    Records, in order:
+    - {"type": "summary", "success", "message", "parameters", "has_transcripts"}
+    - {"type": "slide", "slide_number", "content", "transcripts"} for every slide
+    - {"type": "unmatched_transcripts", "unmatched_transcripts"}
+    """
+    yield orjson.dumps({
+        "type": "summary",
+        "success": True,
+        "message": message,
+        "parameters": parameters,
+        "has_transcripts": has_transcripts
+    }) + b"\n"
+    
+    for slide_num, (content, transcripts) in slide_data.items():
+        yield orjson.dumps({
+            "type": "slide",
+            "slide_number": slide_num,
+            "content": content,
+            "transcripts": transcripts
+        }) + b"\n"
+    
+    yield orjson.dumps({"type": "unmatched_transcripts", "unmatched_transcripts": unmatched_transcripts}) + b"\n"
+
+
+def _ndjson_to_result(content: bytes) -> Dict:
+    """
+    Rebuild the process-lecture JSON result from its NDJSON records.
+    
+    Args:
+        content: NDJSON output of a streamed process-lecture request
+    
+    Returns:
+        Result dictionary in the same shape as the non-streamed response
+    
+    Raises:
+        orjson.JSONDecodeError: If a line is not valid JSON
+        HTTPException: If a line is not a process-lecture record
+    """
+    data = {"slide_data": {}}
+    success = False
+    
+    for line in content.splitlines():
+        if not line.strip():
+            continue
+        record = orjson.loads(line)
+        if not isinstance(record, dict):
+            raise HTTPException(status_code=400, detail="Invalid JSON file")
+        record_type = record.pop("type", None)
+        
+        try:
+            if record_type == "summary":
+                success = record.pop("success", False)
+                data.update(record)
+            elif record_type == "slide":
+                data["slide_data"][str(record["slide_number"])] = record
+            elif record_type == "unmatched_transcripts":
+                data["unmatched_transcripts"] = record["unmatched_transcripts"]
+        except KeyError:
+            raise HTTPException(status_code=400, detail="Invalid JSON file")
+    
+    return {"success": success, "message": data.pop("message", ""), "data": data}
+
 
 @app.get("/")
 async def root():
@@ -79,12 +350,93 @@ async def root():
     }
 
 
+def _run_lecture_pipeline(
+    pdf_source: Union[str, bytes],
+    pdf_hash: str,
+    transcript_paths: List[str],
+    window_size: int,
+    similarity_threshold: float
+) -> Tuple[Dict[int, str], Dict, List[str], int, int]:
+    """
+    Extract the slides and match the transcripts to them; blocking, run it in a worker thread.
+    
+    Args:
+        pdf_source: Path to the PDF file, or its raw bytes
+        pdf_hash: Hash of the PDF bytes, used to cache the extracted pages
+        transcript_paths: Paths of the transcript files (may be empty)
+        window_size: Window size for chunk matching
+        similarity_threshold: Similarity threshold for matching
+    
+    Returns:
+        Tuple of (pages, slide_data, unmatched_transcripts, matched_slides, total_transcripts)
+        - slide_data: {slide_num: (slide_content, [transcript_sentences])}
+    """
+    # Step 1: Extract slides from PDF
+    logger.info("Step 1: Extracting slides from PDF")
+    if vision_model is not None:
+        logger.info("Vision model available - will analyze images in slides")
+        extractor = PageContentExtractor(vision_model=vision_model, vision_tokenizer=vision_tokenizer, vision_device=vision_device, vision_batch_size=VISION_BATCH_SIZE, converter=app.state.converter)
+    else:
+        logger.warning("Vision model not available - images will not be analyzed")
+        extractor = PageContentExtractor(converter=app.state.converter)
+    pages = extractor.extract_pages(pdf_source, pdf_hash=pdf_hash)
+    logger.info(f"Extracted {len(pages)} pages")
+    
+    if not pages:
+        raise HTTPException(status_code=400, detail="No pages could be extracted from PDF")
+    
+    if not transcript_paths:
+        # No transcripts provided - build structure with only slide content
+        logger.info("Step 2: No transcript files provided - building slide-only data structure")
+        slide_data = {page_num: (content, []) for page_num, content in pages.items()}
+        return pages, slide_data, [], 0, 0
+    
+    # Step 2: Process transcripts and generate embeddings
+    logger.info(f"Step 2: Processing {len(transcript_paths)} transcript file(s)")
+    lines = process_transcripts(transcript_paths)
+    transcripts = build_transcripts(lines)
+    logger.info(f"Processed {len(transcripts)} transcript sentences from {len(transcript_paths)} file(s)")
+    
+    if not transcripts:
+        raise HTTPException(status_code=400, detail="No transcripts could be processed from file")
+    
+    # Step 3: Match transcripts to slides and create chunks
+    logger.info("Step 3: Matching transcripts to slides")
+    chunker = app.state.chunker
+    chunks = chunker.build_chunks_with_windows(
+        transcript_sentences=transcripts,
+        slide_pages=pages,
+        window_size=window_size,
+        similarity_threshold=similarity_threshold
+    )
+    
+    logger.info(f"Created {len(chunks)} chunks")
+    
+    # Step 4: Build simple dictionary structure
+    logger.info("Step 4: Building data structure")
+    slide_data, unmatched_transcripts = chunker.build_simple_dict(chunks, pages, lines)
+    
+    # Check if any transcripts were matched
+    matched_slides = 0
+    total_transcripts = 0
+    for _, slide_transcripts in slide_data.values():
+        total_transcripts += len(slide_transcripts)
+        matched_slides += bool(slide_transcripts)
+    
+    if matched_slides == 0:
+        logger.warning("No transcripts were matched to any slides. The similarity threshold may be too high or the content doesn't match.")
+    
+    logger.info(f"Matched {total_transcripts} transcript segments, {len(unmatched_transcripts)} unmatched")
+    return pages, slide_data, unmatched_transcripts, matched_slides, total_transcripts
+
+
 @app.post("/process-lecture")
 async def process_lecture(
     pdf_file: UploadFile = File(..., description="PDF file containing lecture slides"),
     transcript_files: List[UploadFile] = File(default=[], description="Optional: One or more text files containing transcripts (will be merged if multiple)"),
     window_size: int = Form(5),
-    similarity_threshold: float = Form(0.60)
+    similarity_threshold: float = Form(0.60),
+    stream: bool = Form(False)
 ):
     """
     Process a lecture PDF and optionally match with transcript file(s).
@@ -94,6 +446,7 @@ async def process_lecture(
     - transcript_files: Optional - One or more text files with transcripts (will be merged if multiple)
     - window_size: Window size for chunk matching (default: 5, only used with transcripts)
     - similarity_threshold: Similarity threshold for matching (default: 0.60, only used with transcripts)
+    - stream: Stream the result as NDJSON, one record per line, instead of a single JSON object (default: False)
     
     Returns:
     - slide_data: Dictionary mapping slide numbers to content and optionally transcripts
@@ -118,79 +471,35 @@ async def process_lecture(
     
     try:
         # Create temporary files
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as temp_pdf:
-            temp_pdf_path = temp_pdf.name
-            content = await pdf_file.read()
-            temp_pdf.write(content)
+        # Keep the PDF in memory unless it is large, in which case it goes to a temporary file
+        pdf_hasher = hashlib.blake2b(digest_size=16)
+        pdf_source = await _read_pdf_upload(pdf_file, pdf_hasher)
+        pdf_hash = pdf_hasher.hexdigest()
+        if isinstance(pdf_source, str):
+            temp_pdf_path = pdf_source
             logger.info(f"Saved PDF to temporary file: {temp_pdf_path}")
+        else:
+            logger.info(f"Read PDF into memory: {len(pdf_source)} bytes")
         
-        # Save all transcript files to temporary locations
+        # Save all transcript files to temporary locations (raw bytes, process_transcripts decodes them)
         for i, transcript_file in enumerate(transcript_files):
-            with tempfile.NamedTemporaryFile(delete=False, suffix='.txt', mode='w', encoding='utf-8') as temp_transcript:
+            with tempfile.NamedTemporaryFile(delete=False, suffix='.txt', mode='wb') as temp_transcript:
                 temp_transcript_path = temp_transcript.name
                 temp_transcript_paths.append(temp_transcript_path)
-                content = await transcript_file.read()
-                temp_transcript.write(content.decode('utf-8'))
+                await _stream_upload_to_file(transcript_file, temp_transcript)
                 logger.info(f"Saved transcript file {i+1} ('{transcript_file.filename}') to: {temp_transcript_path}")
         
-        # Step 1: Extract slides from PDF
-        logger.info("Step 1: Extracting slides from PDF")
-        if vision_model is not None:
-            logger.info("Vision model available - will analyze images in slides")
-            extractor = PageContentExtractor(vision_model=vision_model, vision_tokenizer=vision_tokenizer, vision_device=vision_device)
-        else:
-            logger.warning("Vision model not available - images will not be analyzed")
-            extractor = PageContentExtractor()
-        pages = extractor.extract_pages(temp_pdf_path)
-        logger.info(f"Extracted {len(pages)} pages")
-        
-        if not pages:
-            raise HTTPException(status_code=400, detail="No pages could be extracted from PDF")
-        
-        # Check if transcripts are provided
+        # Run the CPU/GPU-bound steps on the pipeline thread so the event loop keeps serving other requests
         has_transcripts = len(temp_transcript_paths) > 0
-        
-        if has_transcripts:
-            # Step 2: Process transcripts and generate embeddings
-            logger.info(f"Step 2: Processing {len(temp_transcript_paths)} transcript file(s)")
-            lines = process_transcripts(temp_transcript_paths)
-            transcripts = build_transcripts(lines)
-            logger.info(f"Processed {len(transcripts)} transcript sentences from {len(temp_transcript_paths)} file(s)")
-            
-            if not transcripts:
-                raise HTTPException(status_code=400, detail="No transcripts could be processed from file")
-            
-            # Step 3: Match transcripts to slides and create chunks
-            logger.info("Step 3: Matching transcripts to slides")
-            chunker = TranscriptSlideChunker(model)
-            chunks = chunker.build_chunks_with_windows(
-                transcript_sentences=transcripts,
-                slide_pages=pages,
-                window_size=window_size,
-                similarity_threshold=similarity_threshold
-            )
-            
-            logger.info(f"Created {len(chunks)} chunks")
-            
-            # Step 4: Build simple dictionary structure
-            logger.info("Step 4: Building data structure")
-            slide_data, unmatched_transcripts = chunker.build_simple_dict(chunks, pages, lines)
-            
-            # Check if any transcripts were matched
-            matched_slides = sum(1 for _, (_, transcripts) in slide_data.items() if len(transcripts) > 0)
-            total_transcripts = sum(len(transcripts) for _, (_, transcripts) in slide_data.items())
-            
-            if matched_slides == 0:
-                logger.warning("No transcripts were matched to any slides. The similarity threshold may be too high or the content doesn't match.")
-            
-            logger.info(f"Matched {total_transcripts} transcript segments, {len(unmatched_transcripts)} unmatched")
-        else:
-            # No transcripts provided - build structure with only slide content
-            logger.info("Step 2: No transcript files provided - building slide-only data structure")
-            slide_data = {page_num: (content, []) for page_num, content in pages.items()}
-            unmatched_transcripts = []
-            matched_slides = 0
-            total_transcripts = 0
+        pages, slide_data, unmatched_transcripts, matched_slides, total_transcripts = await asyncio.get_running_loop().run_in_executor(
+            _PIPELINE_EXECUTOR,
+            _run_lecture_pipeline,
+            pdf_source,
+            pdf_hash,
+            temp_transcript_paths,
+            window_size,
+            similarity_threshold
+        )
         
         # Prepare response
         if has_transcripts:
@@ -198,6 +507,22 @@ async def process_lecture(
         else:
             message = f"Lecture processed successfully. Extracted {len(pages)} slides (no transcripts provided)."
         
+        parameters = {
+            "window_size": window_size,
+            "similarity_threshold": similarity_threshold
+        }
+        
+        # Temporary files are removed after the response has been sent
+        cleanup = BackgroundTask(_cleanup_temp_files, [temp_pdf_path, *temp_transcript_paths])
+        
+        if stream:
+            logger.info("Processing completed successfully, streaming response as NDJSON")
+            return StreamingResponse(
+                _iter_ndjson_response(message, slide_data, unmatched_transcripts, parameters, has_transcripts),
+                media_type="application/x-ndjson",
+                background=cleanup
+            )
+        
         response_data = {
             "success": True,
             "message": message,
@@ -211,39 +536,24 @@ async def process_lecture(
                     for slide_num, (content, transcripts) in slide_data.items()
                 },
                 "unmatched_transcripts": unmatched_transcripts,
-                "parameters": {
-                    "window_size": window_size,
-                    "similarity_threshold": similarity_threshold
-                },
+                "parameters": parameters,
                 "has_transcripts": has_transcripts
             }
         }
         
+        # Serialize off the event loop too; the payload can be large for long lectures
+        body = await asyncio.to_thread(orjson.dumps, response_data)
+        
         logger.info("Processing completed successfully")
-        return JSONResponse(content=response_data)
+        return Response(content=body, media_type="application/json", background=cleanup)
     
     except HTTPException:
+        _cleanup_temp_files([temp_pdf_path, *temp_transcript_paths])
         raise
     except Exception as e:
+        _cleanup_temp_files([temp_pdf_path, *temp_transcript_paths])
         logger.error(f"Error processing lecture: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"Error processing lecture: {str(e)}")
-    
-    finally:
-        # Cleanup temporary files
-        if temp_pdf_path and os.path.exists(temp_pdf_path):
-            try:
-                os.unlink(temp_pdf_path)
-                logger.info(f"Cleaned up temporary PDF file")
-            except Exception as e:
-                logger.warning(f"Could not delete temporary PDF file: {e}")
-        
-        for temp_transcript_path in temp_transcript_paths:
-            if temp_transcript_path and os.path.exists(temp_transcript_path):
-                try:
-                    os.unlink(temp_transcript_path)
-                    logger.info(f"Cleaned up temporary transcript file")
-                except Exception as e:
-                    logger.warning(f"Could not delete temporary transcript file: {e}")
 
 
 @app.post("/convert-to-markdown")
@@ -254,14 +564,18 @@ async def convert_to_markdown(
     Convert a JSON result file to markdown format.
     
     Parameters:
-    - json_file: JSON file from the process-lecture endpoint
+    - json_file: JSON (or streamed NDJSON) file from the process-lecture endpoint
     
     Returns:
     - Markdown formatted content
     """
     try:
         content = await json_file.read()
-        data = json.loads(content.decode('utf-8'))
+        try:
+            data = orjson.loads(content)
+        except orjson.JSONDecodeError:
+            # Not a single JSON document, may be the NDJSON output of a streamed request
+            data = _ndjson_to_result(content)
         
         if not data.get("success"):
             raise HTTPException(status_code=400, detail="Invalid JSON format or processing failed")
@@ -280,13 +594,22 @@ async def convert_to_markdown(
             "message": f"Successfully converted {len(slide_data)} slides to markdown"
         }
     
-    except json.JSONDecodeError:
+    except HTTPException:
+        raise
+    except orjson.JSONDecodeError:
         raise HTTPException(status_code=400, detail="Invalid JSON file")
     except Exception as e:
         logger.error(f"Error converting to markdown: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"Error converting to markdown: {str(e)}")
 
 
+# Docling placeholder comments dropped from the markdown export
+_SKIPPED_SLIDE_LINES = frozenset({"<!-- image -->", "<!-- formula-not-decoded -->"})
+
+# Leading "##", "###", ... of a markdown heading, including the following whitespace
+_HEADING_PREFIX_RE = re.compile(r"^##+\s*")
+
+
 def _clean_slide_content(content: str) -> str:
     """Clean and format slide content by removing markdown artifacts."""
     lines = []
@@ -294,12 +617,8 @@ def _clean_slide_content(content: str) -> str:
     for line in content.split("\n"):
         line = line.strip()
         
-        # Skip empty lines at the start
-        if not line and not lines:
-            continue
-        
-        # Skip image and formula comments
-        if line in ["<!-- image -->", "<!-- formula-not-decoded -->"]:
+        # Skip empty lines and image/formula comments
+        if not line or line in _SKIPPED_SLIDE_LINES:
             continue
         
         # Convert Image Analysis heading to H3 (###)
@@ -307,7 +626,7 @@ def _clean_slide_content(content: str) -> str:
             line = "### Image Analysis"
         # Remove other markdown heading symbols (##) but keep the text content
         elif line.startswith("##"):
-            line = line.lstrip("#").strip()
+            line = _HEADING_PREFIX_RE.sub("", line, count=1)
         
         # Remove bold markdown (**) from text
         if "**" in line:
@@ -323,6 +642,10 @@ def _clean_slide_content(content: str) -> str:
     return "\n".join(lines)
 
 
+# Horizontal rule appended after every slide in the markdown export
+_SLIDE_SEPARATOR = "\n" + "_" * 80 + "\n"
+
+
 def convert_slide_data_to_markdown(slide_data: Dict) -> str:
     """
     Convert slide data dictionary to markdown format.
@@ -335,21 +658,43 @@ def convert_slide_data_to_markdown(slide_data: Dict) -> str:
     """
     results = []
     
-    for slide_num in sorted(slide_data.keys(), key=lambda x: int(x)):
+    for slide_num in sorted(slide_data, key=int):
         slide_info = slide_data[slide_num]
         slide_number = slide_info["slide_number"]
         slide_content = _clean_slide_content(slide_info["content"])
         slide_transcripts = slide_info["transcripts"]
         
         # Format with proper markdown headings (H1 for slide number, H2 for sections)
-        result = f"# slide number {slide_number}\n\n## slide_content\n\n{slide_content}"
-        
         # Only add transcript section if transcripts exist
-        if slide_transcripts and len(slide_transcripts) > 0:
+        if slide_transcripts:
             transcripts_text = "\n".join(slide_transcripts)
-            result += f"\n\n## slide_transcripts\n{transcripts_text}"
-        
-        result += "\n" + "_"*80 + "\n"
-        results.append(result)
+            results.append(f"# slide number {slide_number}\n\n## slide_content\n\n{slide_content}\n\n## slide_transcripts\n{transcripts_text}{_SLIDE_SEPARATOR}")
+        else:
+            results.append(f"# slide number {slide_number}\n\n## slide_content\n\n{slide_content}{_SLIDE_SEPARATOR}")
     
     return "\n".join(results)
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    # Each worker loads its own copy of the models in lifespan, so only run
+    # multiple workers on GPU when explicitly allowed via ALLOW_GPU_WORKERS.
+    workers = int(os.environ.get("UVICORN_WORKERS", min(os.cpu_count() or 1, 4)))
+    if torch.cuda.is_available() and os.environ.get("ALLOW_GPU_WORKERS", "false").lower() != "true":
+        workers = 1
+
+    # Split the CPU cores between workers. torch is already configured in this
+    # process, so this only reaches the spawned workers, which re-import the module.
+    os.environ.setdefault("TORCH_NUM_THREADS", str(max(1, (os.cpu_count() or 1) // workers)))
+
+    # A single worker serves the app object loaded here; an import string makes
+    # uvicorn import the module again, which it only needs for multiple workers.
+    uvicorn.run(
+        app if workers == 1 else "app:app",
+        host="0.0.0.0",
+        port=8000,
+        loop="uvloop",
+        http="httptools",
+        workers=workers
+    )
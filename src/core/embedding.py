@@ -1,16 +1,193 @@
+from typing import List, Tuple
+import os
+import numpy as np
+import torch
 from sentence_transformers import SentenceTransformer
 
-model = SentenceTransformer('all-MiniLM-L6-v2')
+try:
+    import faiss
+except ImportError:  # faiss is optional, matching falls back to a numpy matrix product
+    faiss = None
+
+from src.core.embedding_cache import EmbeddingCache
+
+MODEL_ID = 'all-MiniLM-L6-v2'
+
+# Number of texts per encoder forward pass
+EMBED_BATCH_SIZE = 64
+
+# "torch", or "onnx" to run the sentence encoder on CPU with onnxruntime
+EMBEDDING_BACKEND = os.environ.get("EMBEDDING_BACKEND", "torch").lower()
+
+# ONNX export used by the onnx backend; the model repo ships int8-quantized variants per instruction set
+EMBEDDING_ONNX_FILE = os.environ.get("EMBEDDING_ONNX_FILE", "onnx/model_qint8_avx512_vnni.onnx")
+
+EMBEDDING_DEVICE = "cuda" if torch.cuda.is_available() else "cpu"
+
+if EMBEDDING_BACKEND == "onnx":
+    # Quantized int8 GEMMs through onnxruntime's CPU provider (VNNI where the CPU has it)
+    model = SentenceTransformer(MODEL_ID, device="cpu", backend="onnx", model_kwargs={"file_name": EMBEDDING_ONNX_FILE})
+    EMBEDDING_VARIANT = f"onnx-{EMBEDDING_ONNX_FILE}"
+else:
+    model = SentenceTransformer(MODEL_ID, device=EMBEDDING_DEVICE)
+    if EMBEDDING_DEVICE == "cuda":
+        # fp16 weights run on tensor cores
+        model.half()
+        EMBEDDING_VARIANT = "torch-cuda-fp16"
+    else:
+        # On CPU, run the transformer's linear layers in int8 (dynamic quantization)
+        transformer = model._first_module()
+        transformer.auto_model = torch.quantization.quantize_dynamic(
+            transformer.auto_model, {torch.nn.Linear}, dtype=torch.qint8
+        )
+        EMBEDDING_VARIANT = "torch-cpu-int8"
+
+# Each backend/device/precision produces slightly different vectors, so they are cached apart
+embedding_cache = EmbeddingCache(os.environ.get("EMBEDDING_CACHE_DIR", ".emb_cache"), f"{MODEL_ID}:{EMBEDDING_VARIANT}")
 
 def embed_single(line: str):
     """
     Generate embedding for a single text string.
     
+    Prefer embed_batch for more than one text, which shares forward passes between texts.
+    
     Args:
         line: Text to embed
         
     Returns:
-        Embedding array
+        L2-normalized embedding array
+    """
+    return embed_batch([line])[0]
+
+def embed_batch(lines: List[str], batch_size: int = EMBED_BATCH_SIZE) -> np.ndarray:
+    """
+    Generate L2-normalized embeddings for a list of texts in batched forward passes.
+    
+    Args:
+        lines: Texts to embed
+        batch_size: Number of texts per forward pass
+        
+    Returns:
+        Array of shape (len(lines), dimension) in the same order as lines
+    """
+    return encode_sorted(lines, batch_size=batch_size, normalize_embeddings=True)
+
+def _token_lengths(encoder: SentenceTransformer, lines: List[str]) -> List[int]:
+    """Number of tokens per text, falling back to character counts without a fast tokenizer."""
+    tokenizer = getattr(encoder, "tokenizer", None)
+    if tokenizer is None or not getattr(tokenizer, "is_fast", False):
+        return [len(line) for line in lines]
+    return tokenizer(lines, add_special_tokens=False, return_length=True)["length"]
+
+def encode_sorted(
+    lines: List[str],
+    encoder: SentenceTransformer = None,
+    batch_size: int = EMBED_BATCH_SIZE,
+    normalize_embeddings: bool = False
+) -> np.ndarray:
+    """
+    Encode texts in token-length-sorted batches so each batch pads to a similar length.
+    
+    Every batch is a separate encode call: given the whole list, SentenceTransformer
+    would re-sort it by character count, which tracks the padded token length less closely.
+    
+    Args:
+        lines: Texts to embed
+        encoder: Model to encode with (defaults to the shared model)
+        batch_size: Number of texts per forward pass
+        normalize_embeddings: Scale the embeddings to unit length
+        
+    Returns:
+        Array of embeddings in the same order as lines
+    """
+    encoder = encoder if encoder is not None else model
+    if not lines:
+        return np.empty((0, encoder.get_sentence_embedding_dimension()), dtype=np.float32)
+    
+    lengths = _token_lengths(encoder, lines)
+    order = sorted(range(len(lines)), key=lengths.__getitem__)
+    sorted_lines = [lines[i] for i in order]
+    # Grad mode is thread-local, so it is disabled here, in the thread that runs the encoder
+    with torch.inference_mode():
+        sorted_embeddings = np.concatenate([
+            encoder.encode(
+                sorted_lines[start:start + batch_size],
+                batch_size=batch_size,
+                convert_to_numpy=True,
+                normalize_embeddings=normalize_embeddings,
+                show_progress_bar=False
+            )
+            for start in range(0, len(sorted_lines), batch_size)
+        ])
+    
+    # Invert the permutation to restore the original order
+    embeddings = np.empty_like(sorted_embeddings)
+    embeddings[order] = sorted_embeddings
+    return embeddings
+
+def embed_cached(lines: List[str], encoder: SentenceTransformer = None) -> List[np.ndarray]:
+    """
+    Generate embeddings for a list of texts, reusing cached embeddings where possible.
+    
+    Only texts missing from the cache are passed to the encoder, each distinct text once,
+    in a single call. Fresh embeddings are rounded to the cache's float16 precision, so a
+    text gets the same vector whether or not it was cached.
+    
+    Args:
+        lines: Texts to embed
+        encoder: Model to encode cache misses with (defaults to the shared model)
+        
+    Returns:
+        List of embedding arrays in the same order as lines
+    """
+    encoder = encoder if encoder is not None else model
+    embeddings, misses = embedding_cache.get_many(lines)
+    
+    if misses:
+        # Repeated texts (common in transcripts) are encoded once
+        miss_lines = list(dict.fromkeys(lines[i] for i in misses))
+        miss_embeddings = encode_sorted(miss_lines, encoder).astype(np.float16).astype(np.float32)
+        embedding_cache.set_many(miss_lines, miss_embeddings)
+        encoded = dict(zip(miss_lines, miss_embeddings))
+        embeddings.update((i, encoded[lines[i]]) for i in misses)
+    
+    return [embeddings[i] for i in range(len(lines))]
+
+def build_index(embeddings: np.ndarray):
+    """
+    Build a FAISS inner-product index over embeddings, so searches rank by cosine similarity.
+    
+    The index is an exact IndexFlatIP; it only ever holds one deck's slides.
+    
+    Args:
+        embeddings: Array of shape (N, D) to index
+        
+    Returns:
+        FAISS index containing the L2-normalized embeddings
+    """
+    if faiss is None:
+        raise ImportError("faiss is not installed")
+    
+    # normalize_L2 works in place, so normalize a copy rather than the caller's array
+    vectors = np.array(embeddings, dtype=np.float32, copy=True)
+    faiss.normalize_L2(vectors)
+    index = faiss.IndexFlatIP(vectors.shape[1])
+    index.add(vectors)
+    return index
+
+def search(index, query_vecs: np.ndarray, k: int = 1) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Find the k most similar indexed embeddings for each query.
+    
+    Args:
+        index: Index returned by build_index
+        query_vecs: Array of shape (Q, D) of query embeddings
+        k: Number of neighbours per query
+        
+    Returns:
+        Tuple of (similarities, indices), each of shape (Q, k); indices are -1 where
+        the index holds fewer than k vectors
     """
-    embedding = model.encode(line)
-    return embedding
+    queries = np.array(query_vecs, dtype=np.float32, copy=True)
+    faiss.normalize_L2(queries)
+    return index.search(queries, k)
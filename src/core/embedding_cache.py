@@ -0,0 +1,54 @@
+from typing import Dict, List, Sequence, Tuple
+import hashlib
+import numpy as np
+import diskcache
+
+
+class EmbeddingCache:
+    """Disk-backed cache of text embeddings keyed by sha256(model_id + text)."""
+    
+    def __init__(self, directory: str, model_id: str):
+        """
+        Initialize the cache.
+        
+        Args:
+            directory: Directory holding the cache files (shared safely between processes)
+            model_id: Identifier of the embedding model and the variant it runs as (backend,
+                      device, precision), part of every key so models never mix
+        """
+        self.cache = diskcache.Cache(directory)
+        self.model_id = model_id
+    
+    def _key(self, text: str) -> str:
+        return hashlib.sha256(f"{self.model_id}\0{text}".encode("utf-8")).hexdigest()
+    
+    def get_many(self, texts: Sequence[str]) -> Tuple[Dict[int, np.ndarray], List[int]]:
+        """
+        Look up embeddings for a list of texts.
+        
+        Args:
+            texts: Texts to look up
+            
+        Returns:
+            Tuple of (hits, misses)
+            - hits: {index_in_texts: embedding} for cached texts
+            - misses: Indices of texts that still need to be embedded
+        """
+        hits = {}
+        misses = []
+        # One transaction for all lookups instead of one per text
+        with self.cache.transact():
+            for i, text in enumerate(texts):
+                embedding = self.cache.get(self._key(text))
+                if embedding is None:
+                    misses.append(i)
+                else:
+                    hits[i] = embedding.astype(np.float32)
+        return hits, misses
+    
+    def set_many(self, texts: Sequence[str], embeddings: Sequence[np.ndarray]) -> None:
+        """Store embeddings for texts; vectors are kept as float16 to halve disk usage."""
+        # Commit all writes together; a commit per text dominates the cost of large transcripts
+        with self.cache.transact():
+            for text, embedding in zip(texts, embeddings):
+                self.cache.set(self._key(text), np.asarray(embedding, dtype=np.float16))
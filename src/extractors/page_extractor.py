@@ -1,145 +1,451 @@
-from typing import Dict, Optional, Any
+from typing import Dict, List, NamedTuple, Optional, Tuple, Union
+from docling.datamodel.base_models import DocumentStream
 from docling.document_converter import DocumentConverter
 from PIL import Image
+import contextlib
+import hashlib
 import io
+import os
+import queue
+import threading
+import diskcache
 import fitz
+import torch
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Extracted page contents keyed by PDF content hash, so re-uploaded lectures skip extraction
+page_cache = diskcache.Cache(os.environ.get("PAGE_CACHE_DIR", ".page_cache"))
+
+# Part of every page cache key; bump it when a change to extraction alters its output
+PAGE_CACHE_VERSION = 2
+
+# Slide images are rasterized to this many pixels on their longer side (Moondream2's input size)
+VISION_IMAGE_SIZE = 378
+
+# Longest slide text passed to the vision model as context for an image
+MAX_SLIDE_CONTEXT_CHARS = 2000
+
+# A PDF is passed around either as a path on disk or as its raw bytes
+PdfSource = Union[str, bytes]
+
+
+def _open_fitz(pdf_source: PdfSource) -> fitz.Document:
+    """Open a PDF with fitz from a path or from bytes."""
+    if isinstance(pdf_source, bytes):
+        return fitz.open(stream=pdf_source, filetype="pdf")
+    return fitz.open(pdf_source)
+
+
+def _docling_source(pdf_source: PdfSource):
+    """Wrap in-memory PDF bytes in a DocumentStream; paths are passed to Docling unchanged."""
+    if isinstance(pdf_source, bytes):
+        return DocumentStream(name="slides.pdf", stream=io.BytesIO(pdf_source))
+    return pdf_source
+
+
+class ImageJob(NamedTuple):
+    """An image on a slide waiting for vision analysis."""
+    page_no: int
+    img_index: int
+    pil_image: Image.Image
+    question: str
+    image_key: str  # Identifies the image together with its question, for reusing descriptions
+
 
 class PageContentExtractor:
     
-    def __init__(self, vision_model=None, vision_tokenizer=None, vision_device=None):
+    def __init__(self, vision_model=None, vision_tokenizer=None, vision_device=None, vision_batch_size: int = 4, converter: Optional[DocumentConverter] = None):
         """Initialize the document converter.
         
         Args:
             vision_model: Optional vision model for image analysis
             vision_tokenizer: Optional tokenizer for the vision model
             vision_device: Optional device (cuda/cpu) for vision model
+            vision_batch_size: Number of images analyzed per vision model call
+            converter: Optional pre-built DocumentConverter to reuse; a new one is created if omitted
         """
-        self.converter = DocumentConverter()
+        self.converter = converter if converter is not None else DocumentConverter()
         self.vision_model = vision_model
         self.vision_tokenizer = vision_tokenizer
+        if self.vision_model is not None and hasattr(self.vision_model, "eval"):
+            # Inference only: disable dropout and other training-time behaviour
+            self.vision_model.eval()
         self.vision_device = vision_device if vision_device else "cpu"
+        self.vision_batch_size = max(1, vision_batch_size)
     
-    def extract_pages(self, pdf_path: str) -> Dict[int, str]:
+    def extract_pages(self, pdf_source: PdfSource, pdf_hash: Optional[str] = None) -> Dict[int, str]:
         """
         Args:
-            pdf_path: Path to the PDF file
+            pdf_source: Path to the PDF file, or its raw bytes
+            pdf_hash: Optional hash of the PDF bytes. When given, the result is cached on disk
+                      and a later call with the same hash returns it without touching the PDF.
             
         Returns:
             Dictionary mapping page numbers to page content as markdown strings
             Example: {1: "Page 1 content...", 2: "Page 2 content...", ...}
         """
-        # Convert pdf
-        result = self.converter.convert(pdf_path)
-        doc = result.document
+        cache_key = None
+        if pdf_hash is not None:
+            cache_key = (pdf_hash, self._cache_config())
+            cached_pages = page_cache.get(cache_key)
+            if cached_pages is not None:
+                logger.info(f"Using cached page contents for PDF {pdf_hash}")
+                return cached_pages
         
-        # Initialize dictionary
-        page_contents = {}
+        page_contents, complete = self._extract_pages_uncached(pdf_source)
+        
+        if cache_key is not None:
+            if complete:
+                page_cache.set(cache_key, page_contents)
+            else:
+                # Failures may be transient (e.g. CUDA OOM), so retry them on the next upload
+                logger.warning(f"Image analysis was incomplete, not caching page contents for PDF {pdf_hash}")
+        
+        return page_contents
+    
+    def _cache_config(self) -> Tuple:
+        """Settings that change the extracted output; part of the page cache key."""
+        if self.vision_model is None or self.vision_tokenizer is None:
+            return (PAGE_CACHE_VERSION, "text")
+        
+        # Output with and without image analysis differs, as does output from a model loaded
+        # in another precision, so cache them separately
+        return (
+            PAGE_CACHE_VERSION,
+            "vision",
+            VISION_IMAGE_SIZE,
+            MAX_SLIDE_CONTEXT_CHARS,
+            str(getattr(self.vision_model, "dtype", None)),
+            bool(getattr(self.vision_model, "is_loaded_in_8bit", False)),
+        )
+    
+    def _extract_pages_uncached(self, pdf_source: PdfSource) -> Tuple[Dict[int, str], bool]:
+        """
+        Convert the PDF and analyze its images; see extract_pages.
+        
+        Returns:
+            Tuple of (page contents, whether every image was extracted and described)
+        """
+        # Convert pdf to per-page markdown
+        page_markdowns = self._convert_to_markdown(pdf_source)
         
-        # Open PDF with fitz for image extraction (if vision model available)
-        fitz_doc = None
+        # If vision model is available, analyze the images on the pages using fitz
+        image_descriptions = {}
+        complete = True
         if self.vision_model is not None and self.vision_tokenizer is not None:
+            # Parse the PDF with fitz once for all image extraction
             try:
-                fitz_doc = fitz.open(pdf_path)
+                fitz_doc = _open_fitz(pdf_source)
                 logger.info(f"Opened PDF with fitz for image extraction: {len(fitz_doc)} pages")
             except Exception as e:
+                # Fall back to the text-only pages Docling produced
                 logger.warning(f"Failed to open PDF with fitz: {e}")
+                fitz_doc = None
+                complete = False
+            
+            if fitz_doc is not None:
+                with fitz_doc:
+                    image_descriptions, complete = self._analyze_images_fitz(fitz_doc, page_markdowns)
         
-        # Iterate through all pages in the document
-        # doc.pages is a Dict[int, PageItem] where keys are page numbers
-        for page_no in sorted(doc.pages.keys()):
-            # Export content for this specific page using page_no parameter
-            page_markdown = doc.export_to_markdown(page_no=page_no)
+        # Initialize dictionary
+        page_contents = {}
+        
+        # Iterate through all pages in order
+        for page_no in sorted(page_markdowns.keys()):
+            page_markdown = page_markdowns[page_no]
             
-            # If vision model is available, analyze images on this page using fitz
-            if fitz_doc is not None and self.vision_model is not None and self.vision_tokenizer is not None:
-                try:
-                    page_markdown = self._analyze_page_images_fitz(fitz_doc, page_no, page_markdown)
-                except Exception as e:
-                    logger.warning(f"Failed to analyze images on page {page_no}: {e}")
+            # Append image descriptions to the markdown content if any were found
+            if image_descriptions.get(page_no):
+                page_markdown += "\n\n## Image Analysis\n\n"
+                page_markdown += "\n\n".join(image_descriptions[page_no])
             
             page_contents[page_no] = page_markdown
         
-        # Close fitz document
-        if fitz_doc is not None:
-            fitz_doc.close()
+        return page_contents, complete
+    
+    def _convert_to_markdown(self, pdf_source: PdfSource) -> Dict[int, str]:
+        """
+        Convert the PDF with the shared Docling converter and export each page to markdown.
         
-        return page_contents
+        Args:
+            pdf_source: Path to the PDF file, or its raw bytes
+            
+        Returns:
+            Dictionary mapping page numbers to markdown strings
+        """
+        # doc.pages is a Dict[int, PageItem] where keys are page numbers
+        doc = self.converter.convert(_docling_source(pdf_source)).document
+        return {page_no: doc.export_to_markdown(page_no=page_no) for page_no in doc.pages.keys()}
+    
+    def _analyze_images_fitz(
+        self,
+        fitz_doc: fitz.Document,
+        page_markdowns: Dict[int, str]
+    ) -> Tuple[Dict[int, List[str]], bool]:
+        """
+        Describe the images on every page, batching vision model calls across pages.
+        
+        A single producer thread extracts the images from the fitz document and
+        overlaps with vision inference, which drains the extracted images in batches.
+        PyMuPDF is not thread-safe, so the document is only ever used by that thread.
+        Images that occur more than once in the deck (logos, recurring diagrams) are
+        rendered once. Their description is only reused where the question matches too,
+        since it is written against the slide's own text.
+        
+        Args:
+            fitz_doc: Already opened fitz document, only used by the extraction thread
+            page_markdowns: Markdown content per page (used as context for image analysis)
+            
+        Returns:
+            Tuple of (dictionary mapping page numbers to formatted image descriptions,
+            whether every image was extracted and described)
+        """
+        page_nos = sorted(page_markdowns.keys())
+        if not page_nos:
+            return {}, True
+        
+        # Bounded so the producer stays at most a couple of batches ahead of the vision model
+        image_jobs = queue.Queue(maxsize=2 * self.vision_batch_size)
+        stop_extracting = threading.Event()
+        
+        # Images already rendered by content hash, so duplicates are not rendered again
+        rendered_images = {}
+        
+        # Pages or images that could not be extracted or described
+        failures = []
+        
+        def extract_images() -> None:
+            """Producer: extract the images of each page and put them on the queue, then a None sentinel."""
+            try:
+                for page_no in page_nos:
+                    if stop_extracting.is_set():
+                        break
+                    try:
+                        page_jobs = self._extract_page_images_fitz(fitz_doc, page_no, page_markdowns[page_no], rendered_images, failures)
+                        for job in page_jobs:
+                            image_jobs.put(job)
+                    except Exception as e:
+                        logger.warning(f"Failed to extract images on page {page_no}: {e}")
+                        failures.append((page_no, None))
+            finally:
+                image_jobs.put(None)
+        
+        # Consumer: the extraction thread keeps decoding images while this thread runs the
+        # vision model on vision_batch_size images at a time
+        descriptions_by_page = {}
+        descriptions_by_key = {}
+        waiting_jobs = {}  # image_key -> duplicate jobs waiting for an in-flight description
+        in_flight_keys = set()
+        reused = 0
+        
+        def record(job: ImageJob, description: Optional[str]) -> None:
+            if description is None:
+                logger.warning(f"Failed to analyze image {job.img_index} on page {job.page_no}")
+                failures.append((job.page_no, job.img_index))
+            else:
+                descriptions_by_page.setdefault(job.page_no, {})[job.img_index] = description
+        
+        producer = threading.Thread(target=extract_images)
+        producer.start()
+        
+        extraction_done = False
+        try:
+            batch = []
+            while not extraction_done:
+                job = image_jobs.get()
+                if job is None:
+                    extraction_done = True
+                elif job.image_key in descriptions_by_key:
+                    record(job, descriptions_by_key[job.image_key])
+                    reused += 1
+                elif job.image_key in in_flight_keys:
+                    waiting_jobs.setdefault(job.image_key, []).append(job)
+                    reused += 1
+                else:
+                    in_flight_keys.add(job.image_key)
+                    batch.append(job)
+                
+                if len(batch) >= self.vision_batch_size or (batch and extraction_done):
+                    for batch_job, description in zip(batch, self._describe_batch(batch)):
+                        descriptions_by_key[batch_job.image_key] = description
+                        in_flight_keys.discard(batch_job.image_key)
+                        record(batch_job, description)
+                        for waiting_job in waiting_jobs.pop(batch_job.image_key, []):
+                            record(waiting_job, description)
+                    batch = []
+        finally:
+            if not extraction_done:
+                # Let the producer finish its current page, then drain the queue so it can exit
+                stop_extracting.set()
+                while image_jobs.get() is not None:
+                    pass
+            producer.join()
+        
+        if reused:
+            logger.info(f"Reused descriptions for {reused} duplicate image(s)")
+        
+        # Format the descriptions in image order
+        return {
+            page_no: [f"**Image {img_index} Description:** {descriptions[img_index]}" for img_index in sorted(descriptions)]
+            for page_no, descriptions in descriptions_by_page.items()
+        }, not failures
     
-    def _analyze_page_images_fitz(self, fitz_doc: fitz.Document, page_no: int, page_markdown: str) -> str:
+    def _describe_batch(self, batch: List[ImageJob]) -> List[Optional[str]]:
+        """Analyze a batch of image jobs, returning one description (or None on failure) per job."""
+        logger.info(f"Analyzing {len(batch)} image(s) using device: {self.vision_device}")
+        
+        descriptions = self._describe_images([job.pil_image for job in batch], [job.question for job in batch])
+        for job, description in zip(batch, descriptions):
+            if description is not None:
+                logger.info(f"Generated description for image {job.img_index} on page {job.page_no}: {description[:100]}...")
+        return descriptions
+    
+    def _extract_page_images_fitz(
+        self,
+        fitz_doc: fitz.Document,
+        page_no: int,
+        page_markdown: str,
+        rendered_images: Dict[str, Image.Image],
+        failures: List[Tuple[int, Optional[int]]]
+    ) -> List[ImageJob]:
         """
-        Analyze images on a page using fitz and append descriptions to the markdown content.
+        Extract the images on a page and build the vision question for each of them.
         
         Args:
             fitz_doc: Fitz document object
-            page_no: Page number to analyze (1-indexed)
-            page_markdown: Original markdown content (used as context for image analysis)
+            page_no: Page number to extract (1-indexed)
+            page_markdown: Markdown content of the page (used as context for image analysis)
+            rendered_images: Images already rendered, by content hash; duplicates reuse them
+            failures: (page_no, img_index) of images that could not be extracted are appended here
             
         Returns:
-            Enhanced markdown content with image descriptions
+            List of image jobs for the page
         """
         # Convert to 0-indexed for fitz
         page_index = page_no - 1
         
-        # Use the page_markdown as context for better image descriptions
-        slide_context = page_markdown.strip() if page_markdown.strip() else "No text content found on this slide."
+        # Use the page_markdown as context for better image descriptions. The context is
+        # prefilled once per image, so it is capped to bound the prompt length.
+        slide_context = page_markdown.strip()[:MAX_SLIDE_CONTEXT_CHARS] if page_markdown.strip() else "No text content found on this slide."
         
         if page_index < 0 or page_index >= len(fitz_doc):
             logger.warning(f"Page {page_no} out of range in fitz document")
-            return page_markdown
+            return []
         
         page = fitz_doc[page_index]
         images = page.get_images(full=True)
         
         if not images:
             logger.info(f"Page {page_no} has no images")
-            return page_markdown
+            return []
         
         logger.info(f"Page {page_no} has {len(images)} image(s) to analyze")
-        image_descriptions = []
         
-        # Process each image on the page
-        for img_index, img in enumerate(images, 1):
-            try:
-                # Extract image using fitz
-                xref = img[0]
-                base_image = fitz_doc.extract_image(xref)
-                image_bytes = base_image["image"]
-                
-                # Convert bytes to PIL Image
-                pil_image = Image.open(io.BytesIO(image_bytes))
-                logger.info(f"Extracted image {img_index} from page {page_no}: {pil_image.size} {pil_image.mode}")
-                
-                # Analyze the image using moondream vision model
-                logger.info(f"Analyzing image {img_index} on page {page_no} using device: {self.vision_device}")
-                enc_image = self.vision_model.encode_image(pil_image)
-                if hasattr(enc_image, 'to'):
-                    enc_image = enc_image.to(self.vision_device)
-                
-                # Build question with slide context for better descriptions
-                question = f"""This is an image from a university lecture slide. 
+        # Build question with slide context for better descriptions
+        question = f"""This is an image from a university lecture slide. 
 
 Slide text content:
 {slide_context}
 
 Based on the slide content above, describe this image clearly, including any text, diagrams, charts, or key visual elements. Explain how the image relates to the slide content."""
+        question_hash = hashlib.blake2b(question.encode("utf-8"), digest_size=8).hexdigest()
+        
+        image_jobs = []
+        for img_index, img in enumerate(images, 1):
+            try:
+                # Identify the image by its raw stream, so repeated images match even across xrefs
+                xref = img[0]
+                image_hash = hashlib.blake2b(fitz_doc.xref_stream_raw(xref), digest_size=16).hexdigest()
                 
-                description = self.vision_model.answer_question(enc_image, question, self.vision_tokenizer)
-                logger.info(f"Generated description for image {img_index}: {description[:100]}...")
-                
-                # Format the description
-                image_descriptions.append(f"**Image {img_index} Description:** {description}")
+                pil_image = rendered_images.get(image_hash)
+                if pil_image is None:
+                    # Extract image using fitz
+                    pil_image = self._render_image_fitz(fitz_doc, page, xref)
+                    logger.info(f"Extracted image {img_index} from page {page_no}: {pil_image.size} {pil_image.mode}")
+                    rendered_images[image_hash] = pil_image
                 
+                # The description depends on the slide context in the question, not just the image
+                image_jobs.append(ImageJob(page_no, img_index, pil_image, question, f"{image_hash}-{question_hash}"))
             except Exception as e:
-                logger.warning(f"Failed to analyze image {img_index} on page {page_no}: {e}")
-                continue
+                logger.warning(f"Failed to extract image {img_index} on page {page_no}: {e}")
+                failures.append((page_no, img_index))
+        
+        return image_jobs
+    
+    def _render_image_fitz(self, fitz_doc: fitz.Document, page: fitz.Page, xref: int) -> Image.Image:
+        """
+        Get an image from a page as RGB at roughly the vision model's input size.
+        
+        The image's area on the page is rasterized straight to VISION_IMAGE_SIZE pixels on its
+        longer side, which skips decoding the (often much larger) embedded file. Images without
+        a visible area on the page fall back to decoding the embedded bytes, downscaled to the
+        same size.
         
-        # Append image descriptions to the markdown content if any were found
-        if image_descriptions:
-            page_markdown += "\n\n## Image Analysis\n\n"
-            page_markdown += "\n\n".join(image_descriptions)
+        The image is fully decoded here, in the extraction thread, so the vision thread only
+        runs the model's own preprocessing and inference.
+        """
+        rects = [rect for rect in page.get_image_rects(xref) if not rect.is_empty]
+        if rects:
+            rect = rects[0]
+            zoom = VISION_IMAGE_SIZE / max(rect.width, rect.height)
+            pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), clip=rect, alpha=False)
+            return Image.frombytes("RGB", (pix.width, pix.height), pix.samples)
+        
+        # Convert bytes to PIL Image; Image.open is lazy, so decode right away
+        base_image = fitz_doc.extract_image(xref)
+        pil_image = Image.open(io.BytesIO(base_image["image"]))
+        pil_image.draft("RGB", (VISION_IMAGE_SIZE, VISION_IMAGE_SIZE))
+        pil_image = pil_image.convert("RGB")
+        
+        # draft only shrinks JPEGs; bring other formats down to the model's input size too
+        pil_image.thumbnail((VISION_IMAGE_SIZE, VISION_IMAGE_SIZE))
+        return pil_image
+    
+    def _autocast(self):
+        """Mixed-precision context for vision model calls: fp16/bf16 autocast on CUDA, no-op on CPU."""
+        if self.vision_device != "cuda":
+            return contextlib.nullcontext()
         
-        return page_markdown
\ No newline at end of file
+        # Match the precision the model was loaded in (bf16 on Ampere+, fp16 otherwise)
+        dtype = torch.bfloat16 if getattr(self.vision_model, "dtype", None) == torch.bfloat16 else torch.float16
+        return torch.autocast(device_type="cuda", dtype=dtype)
+    
+    def _describe_images(self, pil_images: List[Image.Image], questions: List[str]) -> List[Optional[str]]:
+        """
+        Ask the vision model one question per image for a batch of images.
+        
+        Uses Moondream2's batch_answer when available and falls back to one
+        encode_image/answer_question call per image otherwise.
+        
+        Args:
+            pil_images: Images to describe
+            questions: Prompt for each image
+            
+        Returns:
+            One description per image, None for images that could not be analyzed
+        """
+        with torch.inference_mode(), self._autocast():
+            if len(pil_images) > 1 and hasattr(self.vision_model, "batch_answer"):
+                try:
+                    return self.vision_model.batch_answer(
+                        images=pil_images,
+                        prompts=questions,
+                        tokenizer=self.vision_tokenizer,
+                    )
+                except Exception as e:
+                    logger.warning(f"Batched image analysis failed, analyzing images one by one: {e}")
+            
+            descriptions = []
+            for pil_image, question in zip(pil_images, questions):
+                try:
+                    enc_image = self.vision_model.encode_image(pil_image)
+                    if hasattr(enc_image, 'to'):
+                        enc_image = enc_image.to(self.vision_device)
+                    
+                    descriptions.append(self.vision_model.answer_question(enc_image, question, self.vision_tokenizer))
+                except Exception as e:
+                    logger.warning(f"Failed to analyze image: {e}")
+                    descriptions.append(None)
+            return descriptions
@@ -1,23 +1,26 @@
-from typing import List, Dict
-from src.core.embedding import embed_single
+from typing import List
+import logging
+from src.core.embedding import embed_cached
 
-def build_transcripts(lines: List):
+logger = logging.getLogger(__name__)
+
+def build_transcripts(lines: List, encoder=None):
     """
     Build transcript embeddings dictionary.
     
+    All sentences are encoded together in length-sorted batches rather than one at a time.
+    
     Args:
         lines: List of transcript sentences
+        encoder: SentenceTransformer to encode with (defaults to the shared model)
         
     Returns:
         Dictionary mapping sentences to their embeddings
     """
-    transcripts_embedded = {}
-    print(f"Generating embeddings for {len(lines)} sentences...")
+    logger.info(f"Generating embeddings for {len(lines)} sentences...")
     
-    for i, line in enumerate(lines, 1):
-        transcripts_embedded[line] = embed_single(line)
-        if i % 10 == 0:
-            print(f"  Processed {i}/{len(lines)} sentences")
+    # Embeddings of sentences seen in earlier runs come from the cache
+    transcripts_embedded = dict(zip(lines, embed_cached(lines, encoder)))
     
-    print(f"Generated {len(transcripts_embedded)} embeddings")
+    logger.info(f"Generated {len(transcripts_embedded)} embeddings")
     return transcripts_embedded
\ No newline at end of file
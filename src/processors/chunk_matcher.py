@@ -4,22 +4,60 @@ using cosine similarity and build coherent chunks.
 """
 
 from typing import Dict, List, Tuple
+import logging
+import math
 import numpy as np
-from sklearn.metrics.pairwise import cosine_similarity
+import torch
+
+from src.core import embedding
+from src.core.embedding import embed_cached
+
+logger = logging.getLogger(__name__)
+
+# Window x slide score counts from which similarities are computed on the GPU; below it
+# copying the matrices to the device costs more than the CPU matrix product
+GPU_SIMILARITY_MIN_SCORES = 1_000_000
+
+
+def _l2_normalize(embedding: np.ndarray) -> np.ndarray:
+    """Scale an embedding to unit length, leaving zero vectors untouched."""
+    # sqrt(vdot) skips np.linalg.norm's argument checks and ord dispatch
+    norm = math.sqrt(float(np.vdot(embedding, embedding)))
+    return embedding / norm if norm > 0 else embedding
+
+
+def _best_slides_torch(window_matrix: np.ndarray, slide_matrix: np.ndarray, device: str) -> Tuple[np.ndarray, np.ndarray]:
+    """Best slide index and its similarity for every window, with the matrix product on device."""
+    with torch.inference_mode():
+        similarity_matrix = torch.from_numpy(window_matrix).to(device) @ torch.from_numpy(slide_matrix).to(device).T
+        best_similarities, best_slides = similarity_matrix.max(dim=1)
+    # Only the winners travel back to the host
+    return best_slides.cpu().numpy(), best_similarities.float().cpu().numpy()
+
+
+def _l2_normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    """Scale every row of a matrix to unit length in one pass, leaving zero rows untouched."""
+    norms = np.sqrt(np.einsum("ij,ij->i", matrix, matrix))[:, None]
+    norms[norms == 0] = 1.0
+    return matrix / norms
 
 
 class TranscriptSlideChunker:
     """Match transcript sentences to slides and build coherent chunks."""
     
-    def __init__(self, model):
+    def __init__(self, model, pool_window_embeddings: bool = False):
         """
         Initialize the chunker with an embedding model.
         
         Args:
             model: SentenceTransformer model for generating embeddings
+            pool_window_embeddings: Embed each window as the mean of its sentence embeddings instead
+                                    of encoding the joined window text. Much cheaper, but the scores
+                                    differ from encoded windows, so thresholds may need retuning.
         """
         self.model = model
         self.similarity_threshold = 0.75
+        self.pool_window_embeddings = pool_window_embeddings
     
     def build_chunks_with_windows(
         self,
@@ -40,124 +78,240 @@ class TranscriptSlideChunker:
         Returns:
             List of chunks with matched content
         """
-        self.similarity_threshold = similarity_threshold
+        logger.info(
+            f"Building chunks with windowed approach: window size {window_size} sentences, "
+            f"similarity threshold {similarity_threshold}, {len(transcript_sentences)} transcript sentences, "
+            f"{len(slide_pages)} slide pages"
+        )
         
-        print(f"\nBuilding chunks with WINDOWED approach")
-        print(f"  Window size: {window_size} sentences")
-        print(f"  Similarity threshold: {similarity_threshold}")
-        print(f"  Total transcript sentences: {len(transcript_sentences)}")
-        print(f"  Total slide pages: {len(slide_pages)}")
+        # Create windows from sentences (50% overlap)
+        sentence_list = list(transcript_sentences.keys())
+        if not sentence_list:
+            return []
+        window_starts = range(0, len(sentence_list), max(1, window_size // 2))
+        windows = [sentence_list[i:i + window_size] for i in window_starts]
         
-        # Generate slide embeddings
-        slide_embeddings = self._generate_slide_embeddings(slide_pages)
+        if self.pool_window_embeddings:
+            # Windows come from the sentence embeddings; only the slides go to the encoder
+            _, page_nums, slide_matrix = self._encode_windows_and_slides([], slide_pages)
+            window_embeddings = self._pool_window_embeddings(transcript_sentences, window_starts, window_size)
+        else:
+            window_texts = [" ".join(window_sentences) for window_sentences in windows]
+            window_embeddings, page_nums, slide_matrix = self._encode_windows_and_slides(window_texts, slide_pages)
         
-        # Create windows from sentences
-        sentence_list = list(transcript_sentences.keys())
+        return self.build_chunks_with_windows_from_embeddings(
+            windows, window_embeddings, slide_pages, page_nums, slide_matrix, similarity_threshold
+        )
+    
+    def build_chunks_with_windows_from_embeddings(
+        self,
+        windows: List[List[str]],
+        window_embeddings: np.ndarray,
+        slide_pages: Dict[int, str],
+        page_nums: List[int],
+        slide_matrix: np.ndarray,
+        similarity_threshold: float = 0.60
+    ) -> List[Dict]:
+        """
+        Build chunks from precomputed window and slide embeddings without running the encoder.
+        
+        Args:
+            windows: Consecutive, overlapping windows of transcript sentences
+            window_embeddings: L2-normalized window embeddings, one row per window
+            slide_pages: Dictionary of slide page numbers with content
+            page_nums: Page number of each row of slide_matrix
+            slide_matrix: L2-normalized slide embeddings, one row per page (zero rows for empty slides)
+            similarity_threshold: Minimum cosine similarity to match
+        
+        Returns:
+            List of chunks with matched content
+        """
         chunks = []
         current_chunk = None
         
+        if not windows or not page_nums:
+            return chunks
+        
+        # float32 throughout: one float64 operand would turn the product into a double-precision GEMM
+        slide_matrix = np.asarray(slide_matrix, dtype=np.float32)
+        window_matrix = np.asarray(window_embeddings, dtype=np.float32)
+        
+        if embedding.EMBEDDING_DEVICE == "cuda" and len(windows) * len(page_nums) >= GPU_SIMILARITY_MIN_SCORES:
+            best_slides, best_similarities = _best_slides_torch(window_matrix, slide_matrix, embedding.EMBEDDING_DEVICE)
+        elif embedding.faiss is not None:
+            # Nearest slide per window from a FAISS inner-product index
+            similarities, indices = embedding.search(embedding.build_index(slide_matrix), window_matrix, k=1)
+            best_slides = indices[:, 0]
+            # -1 means FAISS found no result; never a match
+            best_similarities = np.where(best_slides < 0, -np.inf, similarities[:, 0])
+        else:
+            # Score every window against every slide with one matrix product
+            # (embeddings are normalized, so the dot product is the cosine similarity)
+            similarity_matrix = window_matrix @ slide_matrix.T
+            best_slides = similarity_matrix.argmax(axis=1)
+            best_similarities = similarity_matrix[np.arange(len(windows)), best_slides]
+        
+        # Plain Python ints and floats up front, instead of boxing a numpy scalar per window
+        best_slides = best_slides.tolist()
+        best_similarities = best_similarities.tolist()
+        
+        # Checked once; the per-window messages are only formatted when DEBUG is enabled
+        log_matches = logger.isEnabledFor(logging.DEBUG)
+        
         # Process sentences in sliding windows
-        for i in range(0, len(sentence_list), window_size // 2):  # 50% overlap
-            window_sentences = sentence_list[i:i + window_size]
-            if not window_sentences:
-                continue
+        for window_index, window_sentences in enumerate(windows):
+            slide_index = best_slides[window_index]
+            page_num = page_nums[slide_index] if slide_index >= 0 else None
+            similarity = best_similarities[window_index]
             
-            # Combine window sentences into one text
-            window_text = " ".join(window_sentences)
+            if window_index < 10 and log_matches:  # Show first few matches
+                logger.debug(f"Window {window_index + 1}: matched to page {page_num} (sim: {similarity:.3f})")
             
-            # Generate embedding for the window
-            window_embedding = self.model.encode(window_text)
-            
-            # Find best matching slide
-            best_match = self._find_best_slide_match(window_embedding, slide_embeddings)
-            
-            if best_match:
-                page_num, similarity = best_match
-                
-                if i < 20:  # Show first few matches
-                    print(f"  Window {i//window_size + 1}: matched to page {page_num} (sim: {similarity:.3f})")
-                
-                if similarity >= similarity_threshold:
-                    # Check if we should start a new chunk or extend current
-                    if current_chunk is None or current_chunk['page_num'] != page_num:
-                        # Save previous chunk
-                        if current_chunk:
-                            chunks.append(current_chunk)
-                        
-                        # Start new chunk
-                        current_chunk = {
-                            'page_num': page_num,
-                            'slide_content': slide_pages[page_num],
-                            'transcript_sentences': window_sentences.copy(),
-                            'similarities': [similarity] * len(window_sentences),
-                            'window_similarity': similarity
-                        }
-                    else:
-                        # Extend current chunk (avoiding duplicates from overlap)
-                        for sent in window_sentences:
-                            if sent not in current_chunk['transcript_sentences']:
-                                current_chunk['transcript_sentences'].append(sent)
-                                current_chunk['similarities'].append(similarity)
-                else:
-                    # Low similarity - save current chunk and mark as unmatched
+            if similarity >= similarity_threshold:
+                # Check if we should start a new chunk or extend current
+                if current_chunk is None or current_chunk['page_num'] != page_num:
+                    # Save previous chunk
                     if current_chunk:
                         chunks.append(current_chunk)
-                        current_chunk = None
+                    
+                    # Start new chunk (copying the window, which the caller owns and the chunk may extend)
+                    current_chunk = {
+                        'page_num': page_num,
+                        'slide_content': slide_pages[page_num],
+                        'transcript_sentences': window_sentences.copy(),
+                        'similarities': [similarity] * len(window_sentences),
+                        'window_similarity': similarity
+                    }
+                    # Sentences of the current chunk, for O(1) overlap checks
+                    chunk_sentences = set(window_sentences)
+                else:
+                    # Extend current chunk (avoiding duplicates from overlap)
+                    for sent in window_sentences:
+                        if sent not in chunk_sentences:
+                            chunk_sentences.add(sent)
+                            current_chunk['transcript_sentences'].append(sent)
+                            current_chunk['similarities'].append(similarity)
+            else:
+                # Low similarity - save current chunk and mark as unmatched
+                if current_chunk:
+                    chunks.append(current_chunk)
+                    current_chunk = None
         
         # Add final chunk
         if current_chunk:
             chunks.append(current_chunk)
         
-        print(f"\nCreated {len(chunks)} chunks using windowed approach")
+        logger.info(f"Created {len(chunks)} chunks using windowed approach")
         return chunks
     
+    def _encode_windows_and_slides(
+        self,
+        window_texts: List[str],
+        slide_pages: Dict[int, str]
+    ) -> Tuple[np.ndarray, List[int], np.ndarray]:
+        """
+        Embed transcript windows and slide contents.
+        
+        Slide contents go through the embedding cache. Windows are encoded directly:
+        their text depends on window_size and the transcript, so cached windows would
+        almost never be hit again.
+        
+        Embeddings are L2-normalized, so cosine similarity reduces to a dot product.
+        Empty slides get a zero embedding.
+        
+        Returns:
+            Tuple of (window_embeddings, page_nums, slide_matrix)
+            - window_embeddings: One row per window
+            - page_nums: Page number of each row of slide_matrix, in slide_pages order
+            - slide_matrix: One row per page
+        """
+        logger.info("Generating window and slide embeddings...")
+        # Clean and prepare slide content; only non-empty slides go to the encoder
+        cleaned_pages = {page_num: content.strip() for page_num, content in slide_pages.items()}
+        non_empty = [page_num for page_num, content in cleaned_pages.items() if content]
+        
+        dimension = self.model.get_sentence_embedding_dimension()
+        window_embeddings = _l2_normalize_rows(embedding.encode_sorted(window_texts, self.model).astype(np.float32, copy=False))
+        slide_texts = [cleaned_pages[p] for p in non_empty]
+        slide_embeddings = _l2_normalize_rows(np.stack(embed_cached(slide_texts, self.model))) if slide_texts else np.empty((0, dimension), dtype=np.float32)
+        
+        # One contiguous row per page; empty slides keep a zero row
+        page_nums = list(slide_pages.keys())
+        row_of_page = {page_num: row for row, page_num in enumerate(page_nums)}
+        slide_matrix = np.zeros((len(page_nums), dimension), dtype=np.float32)
+        slide_matrix[[row_of_page[p] for p in non_empty]] = slide_embeddings
+        
+        logger.info(f"Generated embeddings for {len(window_texts)} windows and {len(page_nums)} slides")
+        return window_embeddings, page_nums, slide_matrix
+    
+    def _pool_window_embeddings(
+        self,
+        transcript_sentences: Dict[str, np.ndarray],
+        window_starts: range,
+        window_size: int
+    ) -> np.ndarray:
+        """
+        Embed every window as the normalized mean of its normalized sentence embeddings.
+        
+        A prefix sum over the sentence embeddings gives each window sum in O(d), so
+        overlapping windows never re-add the sentences they share.
+        
+        Returns:
+            L2-normalized window embeddings, one row per window
+        """
+        sentence_matrix = _l2_normalize_rows(np.stack(list(transcript_sentences.values())).astype(np.float32))
+        prefix_sums = np.zeros((len(sentence_matrix) + 1, sentence_matrix.shape[1]), dtype=np.float32)
+        np.cumsum(sentence_matrix, axis=0, out=prefix_sums[1:])
+        
+        starts = np.asarray(window_starts)
+        ends = np.minimum(starts + window_size, len(sentence_matrix))
+        # Dividing by the window length would not change the direction, so normalize the sums directly
+        return _l2_normalize_rows(prefix_sums[ends] - prefix_sums[starts])
+    
     def _generate_slide_embeddings(
         self, 
         slide_pages: Dict[int, str]
-    ) -> Dict[int, np.ndarray]:
-        """Generate embeddings for each slide's content."""
-        slide_embeddings = {}
-        
-        print("\nGenerating slide embeddings...")
-        for page_num, content in slide_pages.items():
-            # Clean and prepare slide content
-            cleaned_content = content.strip()
-            if cleaned_content:
-                embedding = self.model.encode(cleaned_content)
-                slide_embeddings[page_num] = embedding
-            else:
-                # Empty slide - create zero embedding
-                slide_embeddings[page_num] = np.zeros(self.model.get_sentence_embedding_dimension())
-        
-        print(f"Generated embeddings for {len(slide_embeddings)} slides")
-        return slide_embeddings
+    ) -> Tuple[List[int], np.ndarray]:
+        """Generate normalized embeddings for each slide's content, as (page_nums, slide_matrix)."""
+        _, page_nums, slide_matrix = self._encode_windows_and_slides([], slide_pages)
+        return page_nums, slide_matrix
     
     def _match_and_chunk(
         self,
         transcript_sentences: Dict[str, np.ndarray],
         slide_pages: Dict[int, str],
-        slide_embeddings: Dict[int, np.ndarray]
+        page_nums: List[int],
+        slide_matrix: np.ndarray,
+        similarity_threshold: float = None
     ) -> List[Dict]:
-        """Match sentences to slides and build chunks."""
+        """Match sentences to slides and build chunks, given the slides as (page_nums, slide_matrix)."""
+        if similarity_threshold is None:
+            similarity_threshold = self.similarity_threshold
+        
         chunks = []
         current_chunk = None
         
-        print("\nMatching sentences to slides...")
+        # Normalize the slide embeddings once instead of per sentence, into one contiguous float32 block
+        slide_matrix = np.ascontiguousarray(_l2_normalize_rows(np.asarray(slide_matrix, dtype=np.float32))) if page_nums else None
+        
+        logger.info("Matching sentences to slides...")
+        log_matches = logger.isEnabledFor(logging.DEBUG)
         for i, (sentence, sentence_embedding) in enumerate(transcript_sentences.items(), 1):
             # Find best matching slide
             best_match = self._find_best_slide_match(
                 sentence_embedding, 
-                slide_embeddings
+                page_nums,
+                slide_matrix
             )
             
             if best_match:
                 page_num, similarity = best_match
                 
-                if i <= 5:  # Show first few matches
-                    print(f"  Sentence {i}: matched to page {page_num} (sim: {similarity:.3f})")
+                if i <= 5 and log_matches:  # Show first few matches
+                    logger.debug(f"Sentence {i}: matched to page {page_num} (sim: {similarity:.3f})")
                 
                 # Check if similarity meets threshold
-                if similarity >= self.similarity_threshold:
+                if similarity >= similarity_threshold:
                     # Start new chunk or continue current one
                     if current_chunk is None or current_chunk['page_num'] != page_num:
                         # Save previous chunk if exists
@@ -199,23 +353,25 @@ class TranscriptSlideChunker:
     def _find_best_slide_match(
         self,
         sentence_embedding: np.ndarray,
-        slide_embeddings: Dict[int, np.ndarray]
+        page_nums: List[int],
+        slide_matrix: np.ndarray
     ) -> Tuple[int, float]:
-        """Find the slide with highest cosine similarity to the sentence."""
-        best_page = None
-        best_similarity = -1.0
-        
-        sentence_embedding = sentence_embedding.reshape(1, -1)
+        """
+        Find the slide with highest cosine similarity to the sentence.
         
-        for page_num, slide_embedding in slide_embeddings.items():
-            slide_embedding = slide_embedding.reshape(1, -1)
-            similarity = cosine_similarity(sentence_embedding, slide_embedding)[0][0]
-            
-            if similarity > best_similarity:
-                best_similarity = similarity
-                best_page = page_num
+        Args:
+            sentence_embedding: Embedding of the sentence
+            page_nums: Page number of each row of slide_matrix
+            slide_matrix: L2-normalized slide embeddings, one row per page
+        """
+        if not page_nums:
+            return None
         
-        return (best_page, best_similarity) if best_page else None
+        # Cast first (a no-op for float32 input) so normalizing is the only copy
+        query = _l2_normalize(sentence_embedding.astype(np.float32, copy=False))
+        similarities = slide_matrix @ query
+        best_index = int(similarities.argmax())
+        return page_nums[best_index], float(similarities[best_index])
 
     
     def build_simple_dict(self, chunks: List[Dict], slide_pages: Dict[int, str] = None, all_transcript_sentences: List[str] = None) -> Tuple[Dict[int, List], List[str]]:
@@ -1,37 +1,43 @@
 import re
 
+# Filler words and phrases, matched in one pass; sentences are lowercased first, so no IGNORECASE
+_FILLERS = ('um', 'uh', 'you know', 'sort of', 'kind of', 'i mean')
+_FILLER_RE = re.compile(r'\b(?:' + '|'.join(map(re.escape, _FILLERS)) + r')\b')
+_WHITESPACE_RE = re.compile(r'\s+')
+_LEADING_PUNCTUATION_RE = re.compile(r'^[,\.\-\s]+')
+
+# Lines, before and after cleaning, need more than this many characters to be kept
+MIN_LINE_LENGTH = 5
+
 def clean_transcript_sentence(sentence: str) -> str:
-    fillers = [
-        r'\bum\b', r'\buh\b', r'\byou know\b', 
-        r'\bsort of\b', r'\bkind of\b', r'\bi mean\b'
-    ]
-    
     sentence_lower = sentence.lower()
 
-    for filler in fillers:
-        sentence_lower = re.sub(filler, '', sentence_lower, flags=re.IGNORECASE)
+    # Substring checks are much cheaper than the regex scan, and most lines contain no filler
+    if any(filler in sentence_lower for filler in _FILLERS):
+        sentence_lower = _FILLER_RE.sub('', sentence_lower)
 
-    sentence_lower = re.sub(r'\s+', ' ', sentence_lower).strip()
-    sentence_lower = re.sub(r'^[,\.\-\s]+', '', sentence_lower)
+    sentence_lower = _WHITESPACE_RE.sub(' ', sentence_lower).strip()
+    sentence_lower = _LEADING_PUNCTUATION_RE.sub('', sentence_lower)
     
     return sentence_lower if sentence_lower else sentence
 
 
-def process_transcripts(path):
+def iter_transcript_lines(path):
     paths = [path] if isinstance(path, str) else path
     
-    clean_lines = []
     tag = "Automatisch gegenereerde transcriptie"
     
-    # Process each file and merge the results
+    # Stream each file line by line and yield the cleaned lines, merging the files in order
     for file_path in paths:
         with open(file_path, "r", encoding='utf-8') as f:
-            lines = f.readlines()
-
-        for line in lines:
-            if len(line) > 5 and tag not in line:
+            for line in f:
+                if len(line) <= MIN_LINE_LENGTH or tag in line:
+                    continue
                 cleaned = clean_transcript_sentence(line.strip())
-                if cleaned and len(cleaned) > 5:
-                    clean_lines.append(cleaned)
+                if len(cleaned) > MIN_LINE_LENGTH:
+                    yield cleaned
+
 
-    return clean_lines
\ No newline at end of file
+def process_transcripts(path):
+    # Collected once, embedding sorts the whole list by length
+    return list(iter_transcript_lines(path))